@@ -6,6 +6,10 @@ This module provides the Block class and several helper functions.
 
 import os
 import hashlib
+from src import compression
+
+# Maximum number of errors reported by validate_blocks()
+MAX_ERRORS = 10
 
 
 class Block:
@@ -25,6 +29,8 @@ class Block:
     index_all: int
     chunk: bytes
     hash_previous: str
+    # Codec of the stored chunk, Block objects sent by the client are always uncompressed
+    codec: str = compression.NO_COMPRESSION
 
     def __init__(self, file_hash, index_all, chunk, hash_previous):
         self.hash = file_hash
@@ -42,10 +48,43 @@ class Block:
         block_hash = hashlib.sha256()
         block_hash.update(bytes(self.hash, 'utf-8'))
         block_hash.update(bytes(str(self.index_all), 'utf-8'))
-        block_hash.update(self.chunk)
+        block_hash.update(self.get_chunk())
         block_hash.update(bytes(self.hash_previous, 'utf-8'))
         return block_hash.hexdigest()
 
+    def get_chunk(self):
+        """
+        Return the uncompressed chunk of this block instance, regardless of the codec
+        which is used to store it.
+
+        :return: The uncompressed chunk of the original file
+        """
+
+        if self.codec == compression.NO_COMPRESSION:
+            return self.chunk
+        return compression.decompress(self.chunk, self.codec)
+
+    def compress_chunk(self, codec: str):
+        """
+        Store the chunk of this block instance compressed with the given codec. The hash
+        of the block is still generated from the uncompressed chunk. If the compression
+        does not reduce the size of the chunk, it is stored uncompressed instead.
+
+        :param codec: The name of the codec used for storing the chunk
+        :return: None
+        """
+
+        if codec == self.codec:
+            return
+        chunk = self.get_chunk()
+        compressed_chunk = compression.compress(chunk, codec)
+        if len(compressed_chunk) < len(chunk):
+            self.chunk = compressed_chunk
+            self.codec = codec
+        else:
+            self.chunk = chunk
+            self.codec = compression.NO_COMPRESSION
+
     def check_file_integrity(self, blocks, index, file_hash, index_all):
         """
         Check if all the blocks belonging to this first block of a file have a valid
@@ -92,6 +131,66 @@ class Block:
         return block_counter == index_all
 
 
+def validate_blocks(blocks):
+    """
+    Validate a list of Block objects belonging to a single file before they are appended
+    to the chain. All blocks must reference the same file hash and number of blocks, the
+    number of blocks must be correct, every block must reference the hash of its previous
+    block and the chunks must add up to the original file. The reference of the first
+    block to the last block in the chain is not checked here.
+
+    :param blocks: A list of Block objects of a single file
+    :return: A list of at most MAX_ERRORS errors, each as a tuple of the position of the
+             invalid block (or None if it concerns all blocks) and an error message
+    """
+
+    if not isinstance(blocks, list) or len(blocks) == 0:
+        return [(None, "No blocks were received")]
+    for position, block in enumerate(blocks):
+        if not isinstance(block, Block):
+            return [(position, "The received object is not a Block object")]
+        if not isinstance(getattr(block, "hash", None), str):
+            return [(position, "The file hash of the block is not a string")]
+        if not isinstance(getattr(block, "index_all", None), int) \
+                or isinstance(block.index_all, bool):
+            return [(position, "The number of blocks of the block is not an integer")]
+        if not isinstance(getattr(block, "chunk", None), bytes):
+            return [(position, "The chunk of the block is not of type bytes")]
+        if not isinstance(getattr(block, "hash_previous", None), str):
+            return [(position, "The previous hash of the block is not a string")]
+        if block.codec != compression.NO_COMPRESSION:
+            return [(position, "The chunk of the block is compressed")]
+
+    errors = []
+    file_hash = blocks[0].hash
+    index_all = blocks[0].index_all
+    if index_all != len(blocks):
+        errors.append((None, f"The number of blocks ({len(blocks)}) does not match "
+                             f"index_all ({index_all})"))
+
+    # Check all the blocks in a single pass while calculating the hash of the original file.
+    # The block hashes are generated sequentially: sending the blocks to worker processes
+    # costs more than hashing their 500 byte chunks, and hashlib keeps the GIL for such
+    # small inputs, so neither processes nor threads make the validation faster.
+    previous_hash = None
+    sha256 = hashlib.sha256()
+    for position, block in enumerate(blocks):
+        if block.hash != file_hash:
+            errors.append((position, "The block references a different file hash"))
+        elif block.index_all != index_all:
+            errors.append((position, "The block references a different number of blocks"))
+        if position > 0 and block.hash_previous != previous_hash:
+            errors.append((position, "The block does not reference the hash of the previous block"))
+        previous_hash = block.generate_hash()
+        sha256.update(block.chunk)
+        if len(errors) >= MAX_ERRORS:
+            return errors
+
+    if sha256.hexdigest() != file_hash:
+        errors.append((None, "The chunks do not match the file hash"))
+    return errors
+
+
 def calculate_file_hash(filepath):
     """
     Calculate the SHA256 checksum hash of a given file.
@@ -114,6 +213,42 @@ def calculate_file_hash(filepath):
     return sha256.hexdigest()
 
 
+def _link_blocks(file_hash: str, filesize: int, chunks, last_block_hash: str):
+    """
+    Generate the Block objects for the chunks of a file, each referencing the hash of
+    its previous block. The first Block object references the given hash of the last
+    block in the current chain.
+
+    :param file_hash: The SHA256 hash of the whole file
+    :param filesize: The size of the file in bytes
+    :param chunks: An iterable of the 500 byte sized chunks of the file
+    :param last_block_hash: The hash of the last block in the current chain
+    :return: A list of all the Block objects of the file
+    """
+
+    # Calculate the number of blocks needed for this file
+    index_all = filesize // 500 + (filesize % 500 > 0)
+
+    # Make sure the index_all is non-zero if the file is empty
+    if index_all == 0:
+        index_all = 1
+
+    # Create the first block of the given file, which is empty for an empty file
+    chunks = iter(chunks)
+    blocks = [Block(file_hash=file_hash,
+                    index_all=index_all,
+                    chunk=next(chunks, b""),
+                    hash_previous=last_block_hash)]
+
+    # Process the rest of the file
+    for chunk in chunks:
+        blocks.append(Block(file_hash=file_hash,
+                            index_all=index_all,
+                            chunk=chunk,
+                            hash_previous=blocks[-1].generate_hash()))
+    return blocks
+
+
 def generate_blocks(filepath, last_block_hash: str):
     """
     Generate all the necessary Block objects of a given file by splitting
@@ -129,34 +264,27 @@ def generate_blocks(filepath, last_block_hash: str):
     file_hash = calculate_file_hash(filepath)
 
     # Generate the necessary number of blocks for the file
-    blocks = []
     with open(filepath, "rb") as file:
-        # Calculate the number of blocks needed for this file
-        filesize = os.path.getsize(filepath)
-        index_all = filesize // 500 + (filesize % 500 > 0)
+        return _link_blocks(file_hash=file_hash,
+                            filesize=os.path.getsize(filepath),
+                            chunks=iter(lambda: file.read(500), b""),
+                            last_block_hash=last_block_hash)
 
-        # Make sure the index_all is non-zero if the opened file is empty
-        if index_all == 0:
-            index_all = 1
 
-        # Create the first block of the given file
-        chunk = file.read(500)
-        first_block = Block(file_hash=file_hash,
-                            index_all=index_all,
-                            chunk=chunk,
-                            hash_previous=last_block_hash)
-        blocks.append(first_block)
-
-        # Process the rest of the file
-        chunk = file.read(500)
-        while chunk:
-            blocks.append(Block(file_hash=file_hash,
-                                index_all=index_all,
-                                chunk=chunk,
-                                hash_previous=blocks[-1].generate_hash()))
-            chunk = file.read(500)
+def generate_blocks_from_data(data: bytes, last_block_hash: str):
+    """
+    Generate all the necessary Block objects of the given data in memory in the same
+    way as generate_blocks() does for a file.
 
-    return blocks
+    :param data: The content of the file
+    :param last_block_hash: The hash of the last block in the current chain
+    :return: A list of all the Block objects of the given data
+    """
+
+    return _link_blocks(file_hash=hashlib.sha256(data).hexdigest(),
+                        filesize=len(data),
+                        chunks=(data[start:start + 500] for start in range(0, len(data), 500)),
+                        last_block_hash=last_block_hash)
 
 
 if __name__ == "__main__":
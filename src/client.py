@@ -4,6 +4,8 @@ the server, check if they are already stored on the server and check the integri
 of the chain on the server.
 The client is started by providing the hostname / IP address and the port of the
 server as arguments on the CLI, for example: python3 -m src.client 127.0.0.1 8000
+The blocks can optionally be compressed for the transfer, for example:
+python3 -m src.client 127.0.0.1 8000 --codec zlib
 
 @author: Manuel Hettich
 """
@@ -14,6 +16,7 @@ import os
 import pickle
 import requests
 from src import block
+from src import compression
 
 SERVER_ID = "8dbaaa72-ff7a-4f95-887c-e3109e577edd"
 
@@ -22,6 +25,7 @@ HELP_MSG = "[send] / [check] a local file (relative path from root folder), " \
 ERROR_CMD_MSG = "The provided command is unknown or the filepath is missing"
 ERROR_FILE_MSG = "Could not access the given filepath"
 ERROR_SRV_MSG = "Could not connect to the given server and verify its authenticity"
+WARNING_CODEC_MSG = "The server does not support the requested codec, sending uncompressed blocks"
 
 
 def main():
@@ -44,6 +48,9 @@ def main():
     # Check if the given server is online and reports a correct ID
     check_connection(host, port)
 
+    # Agree on a codec for the compression of the blocks which are sent to the server
+    codec = negotiate_codec(host, port, args.codec)
+
     print(HELP_MSG)
     while True:
         # Ask user for an input what to do next
@@ -75,7 +82,7 @@ def main():
 
             if command == "send":
                 # Send a new file to the blockchain server
-                send(filepath, host, port)
+                send(filepath, host, port, codec)
 
             elif command == "check":
                 # Check if a local file is stored on the blockchain server by sending its
@@ -123,10 +130,40 @@ def parse_arguments():
     parser = argparse.ArgumentParser()
     parser.add_argument("host", help="hostname or ip address of the server, e.g. 127.0.0.1")
     parser.add_argument("port", help="port of the server, e.g. 8000", type=int)
+    parser.add_argument("--codec",
+                        help="codec for compressing the blocks sent to the server, e.g. zlib",
+                        choices=compression.supported_codecs(),
+                        default=compression.NO_COMPRESSION)
     return parser.parse_args()
 
 
-def send(filepath: str, host: str, port: int):
+def negotiate_codec(host: str, port: int, codec: str):
+    """
+    Check if the given server supports the requested codec for the compression of
+    the blocks and fall back to uncompressed transfers otherwise.
+
+    :param host: The IP address or hostname of the server
+    :param port: The port of the server
+    :param codec: The codec requested by the user
+    :return: The codec which is used for sending blocks to the server
+    """
+
+    if codec == compression.NO_COMPRESSION:
+        return codec
+
+    try:
+        response = requests.get(f"http://{host}:{port}/compression")
+        if response.ok and codec in response.json()["codecs"]:
+            return codec
+    except requests.exceptions.RequestException:
+        pass
+
+    # The server does not support the requested codec (or any compression at all)
+    print(WARNING_CODEC_MSG)
+    return compression.NO_COMPRESSION
+
+
+def send(filepath: str, host: str, port: int, codec: str = compression.NO_COMPRESSION):
     """
     Send a given file to the specified server using the Block class
     and print the response of the server in the command line.
@@ -134,6 +171,7 @@ def send(filepath: str, host: str, port: int):
     :param filepath: The filepath of the file to be sent to the server
     :param host: The IP address or hostname of the server
     :param port: The port of the server
+    :param codec: The codec negotiated with the server for compressing the blocks
     :return: None
     """
 
@@ -148,12 +186,16 @@ def send(filepath: str, host: str, port: int):
         # Collect all blocks into a single binary file using pickle
         blocks_pickled = pickle.dumps(blocks)
 
+        # Compress the whole batch of blocks with the negotiated codec
+        blocks_pickled = compression.compress(blocks_pickled, codec)
+
         # Check connection to the server and its authenticity
         check_connection(host, port)
 
         # Send the collected blocks in a single transfer to the server
         response = requests.post(f"http://{host}:{port}/send",
-                                 files={"file": blocks_pickled})
+                                 files={"file": blocks_pickled},
+                                 data={"codec": codec})
 
         # Print the response from the server
         print(f"Response from Server: {response.json()}")
@@ -0,0 +1,82 @@
+"""
+This module provides the compression codecs which can be used by the client and the
+server for the transfer of pickled Block objects as well as for storing the chunks
+of the blocks in the memory of the server. Additional codecs can be registered with
+the function register_codec().
+
+@author: Manuel Hettich
+"""
+
+import lzma
+import zlib
+
+NO_COMPRESSION = "none"
+
+# Mapping of the codec names to their compression and decompression functions
+CODECS = {
+    NO_COMPRESSION: (bytes, bytes),
+    "zlib": (zlib.compress, zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+
+def register_codec(name: str, compress_function, decompress_function):
+    """
+    Register an additional codec so that it can be negotiated between the client and
+    the server and used for the storage of the chunks on the server.
+
+    :param name: The name of the codec, e.g. 'bz2'
+    :param compress_function: A function accepting and returning bytes to compress data
+    :param decompress_function: A function accepting and returning bytes to decompress data,
+                                it should raise a ValueError for corrupted data
+    :return: None
+    """
+
+    CODECS[name] = (compress_function, decompress_function)
+
+
+def supported_codecs():
+    """
+    Return the names of all the codecs which are currently available.
+
+    :return: A list of the names of all registered codecs
+    """
+
+    return list(CODECS)
+
+
+def compress(data: bytes, codec: str):
+    """
+    Compress the given data with the specified codec.
+
+    :param data: The uncompressed data
+    :param codec: The name of a registered codec
+    :return: The compressed data
+    :raises ValueError: If the codec is unknown
+    """
+
+    if codec not in CODECS:
+        raise ValueError(f"Unknown compression codec: {codec}")
+    return CODECS[codec][0](data)
+
+
+def decompress(data: bytes, codec: str):
+    """
+    Decompress the given data with the specified codec.
+
+    :param data: The compressed data
+    :param codec: The name of a registered codec
+    :return: The uncompressed data
+    :raises ValueError: If the codec is unknown or the data could not be decompressed
+    """
+
+    if codec not in CODECS:
+        raise ValueError(f"Unknown compression codec: {codec}")
+    try:
+        return CODECS[codec][1](data)
+    except (zlib.error, lzma.LZMAError) as error:
+        raise ValueError(f"Could not decompress the data with codec {codec}") from error
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,365 @@
+"""
+This module provides a load generator which simulates many concurrent clients of a
+running server. Every virtual client repeatedly sends new files, checks previously sent
+files or triggers the integrity check of the chain according to a configurable workload
+mix. Sending a file races with the other clients between requesting the hash of the last
+block and sending the blocks, so rejected uploads (forks) are retried with the new last
+block. At the end the throughput, the latencies, the error, fork and retry rates and the
+consistency of the final chain are reported.
+The load generator is started by providing the hostname / IP address and the port of the
+server as arguments on the CLI, for example:
+python3 -m src.loadgen 127.0.0.1 8000 --clients 20 --duration 30 --mix send=5,check=4,integrity=1
+
+@author: Manuel Hettich
+"""
+
+import argparse
+import asyncio
+import math
+import pickle
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from src import block
+from src import compression
+
+OPERATIONS = ("send", "check", "integrity")
+# Code of /send for uploads whose first block does not reference the last block in the chain
+STALE_TIP_CODE = "stale_tip"
+
+
+class LoadStatistics:
+    """
+    The LoadStatistics object collects the latencies and the outcomes of all operations
+    of the virtual clients, the files which were successfully sent and the results of the
+    final consistency check of the chain.
+    """
+
+    def __init__(self):
+        self.latencies = {operation: [] for operation in OPERATIONS}
+        self.errors = {operation: 0 for operation in OPERATIONS}
+        self.forks = 0
+        self.retries = 0
+        self.sent_files = []
+        self.consistency = None
+        self._lock = threading.Lock()
+
+    def record(self, operation: str, latency: float, success: bool):
+        """
+        Record the latency and the outcome of a single operation.
+
+        :param operation: The name of the operation
+        :param latency: The latency of the operation in seconds
+        :param success: Whether the operation was successful
+        :return: None
+        """
+
+        with self._lock:
+            self.latencies[operation].append(latency)
+            if not success:
+                self.errors[operation] += 1
+
+    def record_fork(self, retried: bool):
+        """
+        Record an upload which was rejected because another client appended a file first.
+
+        :param retried: Whether the upload is retried with the new last block
+        :return: None
+        """
+
+        with self._lock:
+            self.forks += 1
+            if retried:
+                self.retries += 1
+
+
+def percentile(values, fraction: float):
+    """
+    Calculate a percentile of the given values using the nearest-rank method.
+
+    :param values: A list of numbers
+    :param fraction: The percentile as a fraction, e.g. 0.99
+    :return: The percentile of the values or 0.0 if there are no values
+    """
+
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def parse_mix(mix: str):
+    """
+    Parse a workload mix in the format 'send=5,check=4,integrity=1' into the weights
+    of the operations.
+
+    :param mix: The workload mix
+    :return: A dictionary mapping every operation to its weight
+    :raises ValueError: If the workload mix is invalid
+    """
+
+    weights = {operation: 0.0 for operation in OPERATIONS}
+    for entry in mix.split(","):
+        operation, _, weight = entry.partition("=")
+        if operation.strip() not in weights:
+            raise ValueError(f"Unknown operation in the workload mix: {operation}")
+        weights[operation.strip()] = float(weight)
+    if sum(weights.values()) <= 0 or min(weights.values()) < 0:
+        raise ValueError("The weights of the workload mix must be positive")
+    return weights
+
+
+def random_file_size(rng: random.Random, distribution: str, min_size: int, max_size: int):
+    """
+    Draw a random file size from the given distribution.
+
+    :param rng: The random number generator of the virtual client
+    :param distribution: Either 'uniform' or 'lognormal' (with the median between both limits)
+    :param min_size: The minimum file size in bytes
+    :param max_size: The maximum file size in bytes
+    :return: The file size in bytes
+    """
+
+    if distribution == "lognormal":
+        median = math.sqrt(max(min_size, 1) * max_size)
+        size = int(rng.lognormvariate(math.log(median), 1.0))
+        return min(max(size, min_size), max_size)
+    return rng.randint(min_size, max_size)
+
+
+def send_random_file(session: requests.Session, url: str, args, rng: random.Random,
+                     stats: LoadStatistics):
+    """
+    Send a new file with random content to the server and retry with the new last block
+    as long as the upload is rejected because another client appended a file first.
+
+    :param session: The HTTP session of the virtual client
+    :param url: The base URL of the server
+    :param args: The parsed arguments of the load generator
+    :param rng: The random number generator of the virtual client
+    :param stats: The statistics of the load generator
+    :return: Whether the file was stored on the server
+    """
+
+    size = random_file_size(rng, args.size_distribution, args.min_size, args.max_size)
+    data = rng.randbytes(size)
+    for attempt in range(args.max_retries + 1):
+        last_block_hash = session.get(f"{url}/latest_block_hash").json()["last_block_hash"]
+        blocks = block.generate_blocks_from_data(data, last_block_hash)
+        response = session.post(f"{url}/send",
+                                files={"file": compression.compress(pickle.dumps(blocks),
+                                                                    args.codec)},
+                                data={"codec": args.codec})
+        result = response.json()
+        if result.get("success"):
+            if result["new_file"]:
+                stats.sent_files.append((blocks[0].hash, blocks[0].index_all))
+            return True
+        if result.get("code") != STALE_TIP_CODE:
+            return False
+        # Another client appended a file in the meantime
+        stats.record_fork(retried=attempt < args.max_retries)
+    return False
+
+
+def check_random_file(session: requests.Session, url: str, rng: random.Random,
+                      stats: LoadStatistics):
+    """
+    Check a file which was previously sent by any virtual client or, if there is none yet,
+    a random hash which must not be stored on the server.
+
+    :param session: The HTTP session of the virtual client
+    :param url: The base URL of the server
+    :param rng: The random number generator of the virtual client
+    :param stats: The statistics of the load generator
+    :return: Whether the server answered correctly
+    """
+
+    if stats.sent_files:
+        file_hash, index_all = rng.choice(stats.sent_files)
+        expected = True
+    else:
+        file_hash, index_all = rng.randbytes(32).hex(), 1
+        expected = False
+    response = session.get(f"{url}/check", params={"file_hash": file_hash, "index_all": index_all})
+    return response.json()["check"] == expected
+
+
+def run_operation(operation: str, session: requests.Session, url: str, args,
+                  rng: random.Random, stats: LoadStatistics):
+    """
+    Run a single operation of a virtual client.
+
+    :param operation: The name of the operation
+    :param session: The HTTP session of the virtual client
+    :param url: The base URL of the server
+    :param args: The parsed arguments of the load generator
+    :param rng: The random number generator of the virtual client
+    :param stats: The statistics of the load generator
+    :return: Whether the operation was successful
+    """
+
+    try:
+        if operation == "send":
+            return send_random_file(session, url, args, rng, stats)
+        if operation == "check":
+            return check_random_file(session, url, rng, stats)
+        return session.get(f"{url}/check_integrity").json()["integrity_check"]
+    except (requests.exceptions.RequestException, ValueError, KeyError):
+        return False
+
+
+async def virtual_client(client_id: int, executor: ThreadPoolExecutor, url: str, args,
+                         weights: dict, deadline: float, stats: LoadStatistics):
+    """
+    Run the operations of a single virtual client until the deadline or the maximum number
+    of operations is reached. The blocking HTTP requests are executed in a thread pool.
+
+    :param client_id: The number of the virtual client
+    :param executor: The thread pool for the HTTP requests
+    :param url: The base URL of the server
+    :param args: The parsed arguments of the load generator
+    :param weights: The weights of the operations
+    :param deadline: The time at which the virtual client stops
+    :param stats: The statistics of the load generator
+    :return: None
+    """
+
+    loop = asyncio.get_running_loop()
+    rng = random.Random(None if args.seed is None else args.seed + client_id)
+    operations_done = 0
+    with requests.Session() as session:
+        while time.monotonic() < deadline and \
+                (args.operations is None or operations_done < args.operations):
+            operation = rng.choices(OPERATIONS, weights=[weights[op] for op in OPERATIONS])[0]
+            start = time.perf_counter()
+            success = await loop.run_in_executor(executor, run_operation, operation,
+                                                 session, url, args, rng, stats)
+            stats.record(operation, time.perf_counter() - start, success)
+            operations_done += 1
+
+
+def check_consistency(url: str, stats: LoadStatistics):
+    """
+    Check the consistency of the chain after the load test: the integrity of the whole chain
+    must be valid and every file which was successfully sent must be stored exactly once.
+
+    :param url: The base URL of the server
+    :param stats: The statistics of the load generator
+    :return: A dictionary with the results of the consistency checks
+    """
+
+    integrity = requests.get(f"{url}/check_integrity").json()["integrity_check"]
+    missing_files = 0
+    for file_hash, index_all in stats.sent_files:
+        response = requests.get(f"{url}/check",
+                                params={"file_hash": file_hash, "index_all": index_all})
+        if not response.json()["check"]:
+            missing_files += 1
+    duplicate_files = len(stats.sent_files) - len(set(stats.sent_files))
+    return {"integrity_check": integrity,
+            "missing_files": missing_files,
+            "duplicate_files": duplicate_files,
+            "consistent": integrity and missing_files == 0 and duplicate_files == 0}
+
+
+def print_report(stats: LoadStatistics, elapsed: float, consistency: dict):
+    """
+    Print the throughput, the latencies, the error, fork and retry rates and the
+    consistency of the chain in the command line.
+
+    :param stats: The statistics of the load generator
+    :param elapsed: The duration of the load test in seconds
+    :param consistency: The results of check_consistency()
+    :return: None
+    """
+
+    total = sum(len(latencies) for latencies in stats.latencies.values())
+    print(f"Operations: {total} in {elapsed:.2f} s ({total / elapsed:.1f} ops/s)")
+    print(f"{'operation':<10} {'count':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'max ms':>9}")
+    for operation in OPERATIONS:
+        latencies = stats.latencies[operation]
+        print(f"{operation:<10} {len(latencies):>7} {stats.errors[operation]:>7} "
+              f"{percentile(latencies, 0.50) * 1000:>9.1f} "
+              f"{percentile(latencies, 0.95) * 1000:>9.1f} "
+              f"{percentile(latencies, 0.99) * 1000:>9.1f} "
+              f"{max(latencies, default=0.0) * 1000:>9.1f}")
+    sends = max(len(stats.latencies["send"]), 1)
+    print(f"Error rate: {sum(stats.errors.values()) / max(total, 1):.2%}, "
+          f"fork rate: {stats.forks / sends:.2f} per send, "
+          f"retry rate: {stats.retries / sends:.2f} per send")
+    print(f"Final chain: {consistency}")
+
+
+def parse_arguments(argv=None):
+    """
+    Read in the server address and the parameters of the load test from the command line
+    arguments with argparse.
+
+    :param argv: The arguments to parse instead of the command line arguments
+    :return: Arguments parsed from the CLI with argparse
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("host", help="hostname or ip address of the server, e.g. 127.0.0.1")
+    parser.add_argument("port", help="port of the server, e.g. 8000", type=int)
+    parser.add_argument("--clients", help="number of virtual clients", type=int, default=10)
+    parser.add_argument("--duration", help="duration of the load test in seconds",
+                        type=float, default=10.0)
+    parser.add_argument("--operations", help="maximum number of operations per client",
+                        type=int, default=None)
+    parser.add_argument("--mix", help="weights of the operations, e.g. send=5,check=4,integrity=1",
+                        default="send=5,check=4,integrity=1")
+    parser.add_argument("--size-distribution", help="distribution of the file sizes",
+                        choices=("uniform", "lognormal"), default="uniform")
+    parser.add_argument("--min-size", help="minimum file size in bytes", type=int, default=0)
+    parser.add_argument("--max-size", help="maximum file size in bytes", type=int, default=50000)
+    parser.add_argument("--max-retries", help="maximum number of retries of a forked upload",
+                        type=int, default=10)
+    parser.add_argument("--codec", help="codec for compressing the blocks sent to the server",
+                        choices=compression.supported_codecs(),
+                        default=compression.NO_COMPRESSION)
+    parser.add_argument("--seed", help="seed of the random number generators", type=int,
+                        default=None)
+    return parser.parse_args(argv)
+
+
+async def run_load_test(args):
+    """
+    Run all virtual clients concurrently against the server and report the results.
+
+    :param args: The parsed arguments of the load generator
+    :return: The statistics of the load generator
+    """
+
+    url = f"http://{args.host}:{args.port}"
+    weights = parse_mix(args.mix)
+    stats = LoadStatistics()
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        await asyncio.gather(*(virtual_client(client_id, executor, url, args, weights,
+                                              start + args.duration, stats)
+                               for client_id in range(args.clients)))
+    elapsed = time.monotonic() - start
+
+    stats.consistency = check_consistency(url, stats)
+    print_report(stats, elapsed, stats.consistency)
+    return stats
+
+
+def main():
+    """
+    Run the load generator with the arguments parsed from the command line.
+
+    :return: None
+    """
+
+    asyncio.run(run_load_test(parse_arguments()))
+
+
+if __name__ == "__main__":
+    main()
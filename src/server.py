@@ -2,25 +2,71 @@
 This module provides all the functionalities of the server. It can state whether
 the server is online, provide the hash of the last block in its chain, accept new
 files, check if a file is already stored on the server and check if the integrity
-of the chain is valid.
+of the chain is valid. The metadata of the blocks and files in the chain can be
+inspected page by page or as a stream.
 The server is started with default values with the following command from the root
 directory of the project:
 python3 -m src.server
 The default IP address and port can be changed by using this command:
 python3 -m src.server --host [HOST] --port [PORT]
+The chunks of the blocks can optionally be stored compressed in memory:
+python3 -m src.server --storage-codec [CODEC]
+A snapshot of the chain of a running server can be exported and imported with:
+python3 -m src.server --host [HOST] --port [PORT] export [FILE]
+python3 -m src.server --host [HOST] --port [PORT] import [FILE] [--trust-manifest]
+A new server can also be bootstrapped directly from a snapshot file:
+python3 -m src.server serve --snapshot [FILE] [--trust-manifest]
 
 @author: Manuel Hettich
 """
 
 import argparse
+import json
 import pickle
-from fastapi import FastAPI, File, UploadFile
+import sys
+import threading
+from fastapi import FastAPI, File, Form, Query, UploadFile
+from fastapi.responses import StreamingResponse
+import requests
 import uvicorn
-from src.block import Block
+from src import compression
+from src import snapshot
+from src.block import Block, validate_blocks
 
 blocks: [Block] = list()
+# Index of all files in the chain, mapping the hash of every file to the position
+# of its first block and its number of blocks
+file_index: {str: [int, int]} = dict()
+# Hashes of all files in the order of their first block in the chain
+file_hashes: [str] = list()
+# Lock which ensures that blocks are only appended to the chain one file at a time
+chain_lock = threading.Lock()
 app = FastAPI()
 
+# Codes of the reasons why received blocks are rejected by /send
+ERROR_INVALID_BLOCKS = "invalid_blocks"
+ERROR_STALE_TIP = "stale_tip"
+
+# Messages of the snapshot subcommands on the CLI
+ERROR_FILE_MSG = "Could not access the given filepath"
+ERROR_SNAPSHOT_MSG = "Could not load the given snapshot"
+ERROR_SRV_MSG = "Could not connect to the given server"
+
+# Maximum number of entries on a single page of /blocks and /files
+MAX_PAGE_SIZE = 1000
+# Number of blocks which are collected before they are sent by /blocks/stream
+STREAM_BATCH_SIZE = 1000
+
+# Codec used for storing the chunks of the received blocks in memory
+storage_codec = compression.NO_COMPRESSION
+# Number of bytes received via /send and stored in memory before and after compression,
+# which are only accessed while holding the statistics lock
+compression_stats = {"wire_compressed_bytes": 0,
+                     "wire_uncompressed_bytes": 0,
+                     "storage_compressed_bytes": 0,
+                     "storage_uncompressed_bytes": 0}
+stats_lock = threading.Lock()
+
 
 @app.get("/")
 def health_check():
@@ -49,13 +95,49 @@ def latest_block_hash():
     return {"last_block_hash": blocks[-1].generate_hash()}
 
 
+@app.get("/compression")
+def compression_info():
+    """
+    Provide the codecs which are supported by this server for the transfer of blocks via /send,
+    so that the client can negotiate a codec, as well as the achieved compression ratios
+    (uncompressed size divided by compressed size) on the wire and in memory.
+
+    :return: The supported codecs, the storage codec and the compression statistics as JSON
+    """
+
+    with stats_lock:
+        stats = dict(compression_stats)
+    return {"codecs": compression.supported_codecs(),
+            "storage_codec": storage_codec,
+            **stats,
+            "wire_ratio": _compression_ratio(stats["wire_uncompressed_bytes"],
+                                             stats["wire_compressed_bytes"]),
+            "storage_ratio": _compression_ratio(stats["storage_uncompressed_bytes"],
+                                                stats["storage_compressed_bytes"])}
+
+
+def _compression_ratio(uncompressed_bytes: int, compressed_bytes: int):
+    """
+    Calculate the compression ratio for the given number of bytes.
+
+    :param uncompressed_bytes: The number of bytes before the compression
+    :param compressed_bytes: The number of bytes after the compression
+    :return: The compression ratio or 1.0 if no data has been compressed yet
+    """
+
+    if compressed_bytes == 0:
+        return 1.0
+    return round(uncompressed_bytes / compressed_bytes, 3)
+
+
 @app.post("/send")
-def send_file(file: UploadFile = File(...)):
+def send_file(file: UploadFile = File(...), codec: str = Form(compression.NO_COMPRESSION)):
     """
     Accept a list of Block objects encoded via pickle in a single transfer and store it in memory
     in a single list (non-persistent) if it is not already stored on the server.
 
     :param file: A list of all the Block objects encoded via pickle.dumps() related to a single file
+    :param codec: The codec which was used by the client to compress the pickled Block objects
     :return: The SHA256 hash checksum of the original file and the number of received Block
     objects as well as a success message and specifying whether it is a new file as JSON
     """
@@ -63,33 +145,254 @@ def send_file(file: UploadFile = File(...)):
     # Load the transferred Block instances as a list
 
     try:
-        received_blocks: [Block] = pickle.loads(file.file.read())
+        compressed_payload = file.file.read()
+        payload = compression.decompress(compressed_payload, codec)
+        received_blocks: [Block] = pickle.loads(payload)
+
+        # Only count payloads which could be decoded in the compression statistics
+        _update_compression_stats(wire_compressed_bytes=len(compressed_payload),
+                                  wire_uncompressed_bytes=len(payload))
+
+        # Validate the received blocks before they can be appended to the chain
+        errors = validate_blocks(received_blocks)
+        if errors:
+            return _validation_failure(errors)
         file_hash = received_blocks[0].hash
         index_all = received_blocks[0].index_all
-
-        # Only store the received list of blocks if it is non-empty and if it is a new file
-        if len(received_blocks) > 0:
-            for block in blocks:
-                if block.hash == file_hash:
-                    # Return the hash of the original file and the number of blocks to the client
-                    return {"success": True,
-                            "new_file": False,
-                            "hash": file_hash,
-                            "index_all": index_all}
+        if file_hash in file_index:
+            # Return the hash of the original file and the number of blocks to the client
+            return {"success": True,
+                    "new_file": False,
+                    "hash": file_hash,
+                    "index_all": index_all}
+
+        # Compress the chunks before taking the lock, so that other requests are not blocked
+        storage_bytes = compress_blocks(received_blocks)
+
+        # Make sure that no other file is appended between checking the last block and appending
+        with chain_lock:
+            # Only store the received list of blocks if it is a new file
+            if file_hash in file_index:
+                # Return the hash of the original file and the number of blocks to the client
+                return {"success": True,
+                        "new_file": False,
+                        "hash": file_hash,
+                        "index_all": index_all}
+
+            # The first block has to reference the currently last block in the chain
+            last_block_hash = blocks[-1].generate_hash() if blocks else '0'
+            if received_blocks[0].hash_previous != last_block_hash:
+                return _validation_failure([(0, "The block does not reference the hash of "
+                                                "the last block in the chain")],
+                                           code=ERROR_STALE_TIP)
 
             # Add the received blocks to the server list
-            blocks.extend(received_blocks)
+            append_blocks(received_blocks)
+        _update_compression_stats(**storage_bytes)
+
+        # Return the hash of the new file and the number of blocks to the client as JSON
+        return {"success": True,
+                "new_file": True,
+                "hash": file_hash,
+                "index_all": len(received_blocks)}
+    except (IndexError, ValueError, pickle.UnpicklingError):
+        return {"success": False}
 
-            # Return the hash of the new file and the number of blocks to the client as JSON
-            return {"success": True,
-                    "new_file": True,
-                    "hash": received_blocks[0].hash,
-                    "index_all": len(received_blocks)}
 
-        # Return an error message since the server did not receive any Block objects
-        return {"success": False}
-    except (IndexError, pickle.UnpicklingError):
-        return {"success": False}
+def _validation_failure(errors, code: str = ERROR_INVALID_BLOCKS):
+    """
+    Create the response for received blocks which could not be validated.
+
+    :param errors: A list of errors as returned by validate_blocks()
+    :param code: The machine-readable reason of the rejection, either ERROR_INVALID_BLOCKS
+                 or ERROR_STALE_TIP if the first block does not reference the last block
+    :return: An error message with the code and the position and the reason of every error
+    """
+
+    return {"success": False,
+            "code": code,
+            "errors": [{"position": position, "message": message}
+                       for position, message in errors]}
+
+
+def _update_compression_stats(**byte_counts):
+    """
+    Add the given numbers of bytes to the compression statistics.
+
+    :param byte_counts: The numbers of bytes to add, using the keys of compression_stats
+    :return: None
+    """
+
+    with stats_lock:
+        for key, byte_count in byte_counts.items():
+            compression_stats[key] += byte_count
+
+
+def compress_blocks(new_blocks: [Block]):
+    """
+    Store the chunks of the given blocks with the configured codec. This is done before
+    taking the chain lock, since compressing large files can take several seconds.
+
+    :param new_blocks: A list of Block objects with uncompressed chunks
+    :return: The numbers of bytes of the chunks before and after the compression, using
+             the keys of compression_stats
+    """
+
+    uncompressed_bytes = sum(len(block.chunk) for block in new_blocks)
+    if storage_codec == compression.NO_COMPRESSION:
+        # The chunks are stored as they are
+        compressed_bytes = uncompressed_bytes
+    else:
+        for block in new_blocks:
+            block.compress_chunk(storage_codec)
+        compressed_bytes = sum(len(block.chunk) for block in new_blocks)
+    return {"storage_uncompressed_bytes": uncompressed_bytes,
+            "storage_compressed_bytes": compressed_bytes}
+
+
+def _build_file_index(new_blocks: [Block], start: int):
+    """
+    Build the file index of the given blocks, mapping the hash of every file to the position
+    of its first block in the chain and its number of blocks.
+
+    :param new_blocks: A list of Block objects
+    :param start: The position of the first of the given blocks in the chain
+    :return: The file index of the given blocks as a dictionary
+    """
+
+    files = {}
+    for position, block in enumerate(new_blocks, start=start):
+        files.setdefault(block.hash, [position, block.index_all])
+    return files
+
+
+def append_blocks(new_blocks: [Block], files: dict = None):
+    """
+    Append the given blocks to the chain and add their files to the file index. This must
+    only be called while holding the chain lock, after compress_blocks().
+
+    :param new_blocks: A list of Block objects which should be appended to the chain
+    :param files: The index of the files of the new blocks with their positions in the
+                  chain, which is built from the blocks if it is not provided
+    :return: None
+    """
+
+    if files is None:
+        files = _build_file_index(new_blocks, start=len(blocks))
+    for file_hash in sorted(files, key=lambda file_hash: files[file_hash][0]):
+        if file_hash not in file_index:
+            file_index[file_hash] = files[file_hash]
+            file_hashes.append(file_hash)
+    blocks.extend(new_blocks)
+
+
+@app.get("/snapshot")
+def export_snapshot():
+    """
+    Stream a binary snapshot of the whole chain including a trailing manifest with the
+    index of all files and the hash of the last block.
+
+    :return: The snapshot as a binary stream
+    """
+
+    # Only export the blocks which are stored at the beginning of the export
+    with chain_lock:
+        chain = blocks[:]
+        files = dict(file_index)
+        tip_hash = chain[-1].generate_hash() if chain else '0'
+    return StreamingResponse(snapshot.write_snapshot(chain, files, tip_hash),
+                             media_type="application/octet-stream")
+
+
+@app.post("/snapshot")
+def import_snapshot(file: UploadFile = File(...), trust_manifest: bool = False):
+    """
+    Bulk-load the chain from a binary snapshot created by /snapshot. This is only possible
+    as long as no blocks are stored on this server yet.
+
+    :param file: The binary snapshot
+    :param trust_manifest: Skip the verification of the block hashes and trust the manifest
+    :return: A success message with the number of loaded blocks and the hash of the last block
+    or an error message as JSON
+    """
+
+    if len(blocks) > 0:
+        return {"success": False, "error": "The chain on this server is not empty"}
+    try:
+        return load_snapshot(file.file, trust_manifest)
+    except ValueError as error:
+        return {"success": False, "error": str(error)}
+
+
+def load_snapshot(file, trust_manifest: bool = False):
+    """
+    Read a snapshot from a file object, verify it and append all its blocks to the chain.
+    Without trusting the manifest, it is checked that every block references its
+    predecessor and that the last block and the file index match the manifest. Trusting
+    the manifest only checks the last block and takes the file index from the manifest.
+
+    :param file: A binary file object containing the snapshot
+    :param trust_manifest: Skip the verification of the block hashes and trust the manifest
+    :return: A success message with the number of loaded blocks and the hash of the last block
+    :raises ValueError: If the snapshot is invalid or the chain is not empty
+    """
+
+    new_blocks, manifest = snapshot.read_snapshot(file)
+    tip_hash = manifest.get("tip_hash")
+
+    if not new_blocks:
+        if tip_hash != '0':
+            raise ValueError("The hash of the last block does not match the manifest")
+    elif trust_manifest:
+        if new_blocks[-1].generate_hash() != tip_hash:
+            raise ValueError("The hash of the last block does not match the manifest")
+    else:
+        previous_hash = '0'
+        for position, block in enumerate(new_blocks):
+            if block.hash_previous != previous_hash:
+                raise ValueError(f"The block at position {position} does not reference "
+                                 f"the previous block")
+            previous_hash = block.generate_hash()
+        if previous_hash != tip_hash:
+            raise ValueError("The hash of the last block does not match the manifest")
+
+    if trust_manifest:
+        # Take the file index from the manifest instead of building it from the blocks
+        files = manifest.get("files")
+        if not isinstance(files, dict) or not all(_is_valid_file_entry(new_blocks, file_hash, entry)
+                                                  for file_hash, entry in files.items()):
+            raise ValueError("The file index of the manifest is invalid")
+    else:
+        files = _build_file_index(new_blocks, start=0)
+        if files != manifest.get("files"):
+            raise ValueError("The file index does not match the manifest")
+
+    storage_bytes = compress_blocks(new_blocks)
+    with chain_lock:
+        if len(blocks) > 0:
+            raise ValueError("The chain on this server is not empty")
+        append_blocks(new_blocks, files)
+    _update_compression_stats(**storage_bytes)
+    return {"success": True, "block_count": len(new_blocks), "tip_hash": tip_hash}
+
+
+def _is_valid_file_entry(new_blocks: [Block], file_hash: str, entry):
+    """
+    Check if an entry of the file index in a manifest references a block of the file
+    within the given blocks.
+
+    :param new_blocks: The list of all Block objects of the snapshot
+    :param file_hash: The hash of the file
+    :param entry: The entry of the file index, which should contain the position of the
+                  first block of the file and its number of blocks
+    :return: Whether the entry is valid
+    """
+
+    if not isinstance(entry, list) or len(entry) != 2 \
+            or not all(isinstance(value, int) and not isinstance(value, bool) for value in entry):
+        return False
+    position = entry[0]
+    return 0 <= position < len(new_blocks) and new_blocks[position].hash == file_hash
 
 
 @app.get("/check")
@@ -105,16 +408,16 @@ def check_file(file_hash: str, index_all: int):
     """
 
     # Find the first correct block in the server list and check its integrity
-    for block_idx, block in enumerate(blocks):
-        if block.hash == file_hash:
-            # Check the integrity of the specified file stored on the server
-            file_integrity = block \
-                .check_file_integrity(blocks=blocks,
-                                      index=block_idx,
-                                      file_hash=file_hash,
-                                      index_all=index_all)
-
-            return {"check": file_integrity, "hash": file_hash}
+    if file_hash in file_index:
+        block_idx = file_index[file_hash][0]
+        # Check the integrity of the specified file stored on the server
+        file_integrity = blocks[block_idx] \
+            .check_file_integrity(blocks=blocks,
+                                  index=block_idx,
+                                  file_hash=file_hash,
+                                  index_all=index_all)
+
+        return {"check": file_integrity, "hash": file_hash}
     # Could not find a matching block on this server
     return {"check": False, "hash": file_hash}
 
@@ -163,7 +466,160 @@ def check_integrity():
     return {"integrity_check": True}
 
 
-if __name__ == '__main__':
+def block_metadata(position: int):
+    """
+    Collect the metadata of the block at the given position in the chain without its chunk.
+
+    :param position: The position of the block in the chain
+    :return: The metadata of the block as a dictionary
+    """
+
+    block = blocks[position]
+    return {"position": position,
+            "block_hash": block.generate_hash(),
+            "file_hash": block.hash,
+            "index_all": block.index_all,
+            "hash_previous": block.hash_previous}
+
+
+@app.get("/blocks")
+def list_blocks(cursor: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE)):
+    """
+    Return the metadata of the blocks in the chain page by page, starting at the position
+    given by the cursor. The returned cursor can be used to request the following page.
+
+    :param cursor: The position of the first block on this page
+    :param limit: The maximum number of blocks on this page
+    :return: The metadata of the blocks and the cursor of the next page (or None if this
+    is the last page) as JSON
+    """
+
+    end = min(cursor + limit, len(blocks))
+    return {"blocks": [block_metadata(position) for position in range(cursor, end)],
+            "next_cursor": end if end < len(blocks) else None}
+
+
+@app.get("/blocks/stream")
+def stream_blocks(cursor: int = Query(0, ge=0), limit: int = Query(None, ge=1)):
+    """
+    Stream the metadata of the blocks in the chain as newline delimited JSON (NDJSON),
+    starting at the position given by the cursor. Only the blocks which are stored at
+    the beginning of the request are streamed.
+
+    :param cursor: The position of the first streamed block
+    :param limit: The maximum number of streamed blocks (default: all remaining blocks)
+    :return: The metadata of the blocks as a stream with one JSON object per line
+    """
+
+    end = len(blocks) if limit is None else min(cursor + limit, len(blocks))
+
+    def generate_lines():
+        # Collect several lines before sending them to reduce the overhead of the stream
+        for start in range(cursor, end, STREAM_BATCH_SIZE):
+            yield "".join(json.dumps(block_metadata(position)) + "\n"
+                          for position in range(start, min(start + STREAM_BATCH_SIZE, end)))
+
+    return StreamingResponse(generate_lines(), media_type="application/x-ndjson")
+
+
+@app.get("/files")
+def list_files(cursor: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE)):
+    """
+    Return the files stored in the chain page by page using the file index, in the order
+    of their first block. The returned cursor can be used to request the following page.
+
+    :param cursor: The number of files which precede this page
+    :param limit: The maximum number of files on this page
+    :return: The hash, the position of the first block and the number of blocks of the files
+    as well as the cursor of the next page (or None if this is the last page) as JSON
+    """
+
+    end = min(cursor + limit, len(file_hashes))
+    files = []
+    for file_hash in file_hashes[cursor:end]:
+        position, index_all = file_index[file_hash]
+        files.append({"file_hash": file_hash, "position": position, "index_all": index_all})
+    return {"files": files, "next_cursor": end if end < len(file_hashes) else None}
+
+
+def export_snapshot_to_file(host: str, port: int, filepath: str):
+    """
+    Download a snapshot of the chain from the given server, store it in a local file
+    and print the result in the command line.
+
+    :param host: The IP address or hostname of the server
+    :param port: The port of the server
+    :param filepath: The filepath of the snapshot file
+    :return: None
+    """
+
+    try:
+        with requests.get(f"http://{host}:{port}/snapshot", stream=True) as response:
+            response.raise_for_status()
+            with open(filepath, "wb") as file:
+                for data in response.iter_content(chunk_size=1024 * 2048):
+                    file.write(data)
+        print(f"Stored the snapshot in {filepath}")
+    except requests.exceptions.RequestException:
+        print(ERROR_SRV_MSG)
+    except IOError:
+        print(ERROR_FILE_MSG)
+
+
+def import_snapshot_from_file(host: str, port: int, filepath: str, trust_manifest: bool):
+    """
+    Upload a local snapshot file to the given server in order to bootstrap its chain
+    and print the response of the server in the command line.
+
+    :param host: The IP address or hostname of the server
+    :param port: The port of the server
+    :param filepath: The filepath of the snapshot file
+    :param trust_manifest: Skip the verification of the block hashes on the server
+    :return: None
+    """
+
+    try:
+        with open(filepath, "rb") as file:
+            response = requests.post(f"http://{host}:{port}/snapshot",
+                                     files={"file": file},
+                                     params={"trust_manifest": trust_manifest})
+        response.raise_for_status()
+        print(f"Response from Server: {response.json()}")
+    except requests.exceptions.RequestException:
+        print(ERROR_SRV_MSG)
+    except IOError:
+        print(ERROR_FILE_MSG)
+
+
+def load_snapshot_from_file(filepath: str, trust_manifest: bool):
+    """
+    Bootstrap the chain of this server from a local snapshot file before it is started
+    and print the result in the command line.
+
+    :param filepath: The filepath of the snapshot file
+    :param trust_manifest: Skip the verification of the block hashes and trust the manifest
+    :return: Whether the snapshot was loaded successfully
+    """
+
+    try:
+        with open(filepath, "rb") as file:
+            print(load_snapshot(file, trust_manifest))
+        return True
+    except ValueError as error:
+        print(f"{ERROR_SNAPSHOT_MSG}: {error}")
+    except IOError:
+        print(ERROR_FILE_MSG)
+    return False
+
+
+def parse_arguments():
+    """
+    Read in the server parameters and the optional subcommand (serve, export or import)
+    from the command line arguments with argparse.
+
+    :return: Arguments parsed from the CLI with argparse
+    """
+
     # Use argparse in order to enable the optional setting of different server parameters
     parser = argparse.ArgumentParser()
     parser.add_argument("--host",
@@ -173,6 +629,45 @@ if __name__ == '__main__':
                         help="port of the server, e.g. 8000",
                         type=int,
                         default=8000)
-    args = parser.parse_args()
+    parser.add_argument("--storage-codec",
+                        help="codec for storing the chunks in memory, e.g. zlib",
+                        choices=compression.supported_codecs(),
+                        default=compression.NO_COMPRESSION)
+
+    subparsers = parser.add_subparsers(dest="command")
+    serve_parser = subparsers.add_parser("serve", help="start the server (default)")
+    serve_parser.add_argument("--snapshot",
+                              help="snapshot file to bootstrap the chain from before starting")
+    serve_parser.add_argument("--trust-manifest",
+                              help="skip the verification of the block hashes in the snapshot",
+                              action="store_true")
+    export_parser = subparsers.add_parser("export",
+                                          help="export a snapshot of the chain of a running "
+                                               "server to a file")
+    export_parser.add_argument("file", help="filepath of the snapshot file")
+    import_parser = subparsers.add_parser("import",
+                                          help="import a snapshot file into a running server "
+                                               "with an empty chain")
+    import_parser.add_argument("file", help="filepath of the snapshot file")
+    import_parser.add_argument("--trust-manifest",
+                               help="skip the verification of the block hashes in the snapshot",
+                               action="store_true")
+    parser.set_defaults(command="serve", snapshot=None, trust_manifest=False)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    if args.command == "export":
+        export_snapshot_to_file(args.host, args.port, args.file)
+        sys.exit()
+    if args.command == "import":
+        import_snapshot_from_file(args.host, args.port, args.file, args.trust_manifest)
+        sys.exit()
+
+    storage_codec = args.storage_codec
+    if args.snapshot and not load_snapshot_from_file(args.snapshot, args.trust_manifest):
+        sys.exit(1)
 
     uvicorn.run(app, host=args.host, port=args.port)
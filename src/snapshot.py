@@ -0,0 +1,174 @@
+"""
+This module provides the binary snapshot format of the chain, which allows a new server
+to be bootstrapped without sending every single file again via /send.
+
+A snapshot starts with a magic header, followed by one record per block in the order of
+the chain and an end marker. Each record contains the hash of the original file, the
+number of blocks of the file, the hash of the previous block and the uncompressed chunk.
+The blocks are followed by a trailing manifest in JSON format with the number of blocks,
+the hash of the last block (tip) and the index of all files in the chain, its length and
+a magic footer, so that the manifest can also be read directly from the end of the file.
+
+@author: Manuel Hettich
+"""
+
+import json
+import struct
+from src.block import Block
+
+MAGIC_HEADER = b"KOISNAP1"
+MAGIC_FOOTER = b"KOISNAPE"
+
+# Markers in front of every record and after the last block
+RECORD_BLOCK = b"\x01"
+RECORD_END = b"\x00"
+
+# Encodings of the hashes: a raw SHA256 digest or a length-prefixed UTF-8 string
+HASH_DIGEST = 0
+HASH_STRING = 1
+
+# Number of block records which are collected before they are yielded by write_snapshot()
+BATCH_SIZE = 1000
+
+_RECORD_STRUCT = struct.Struct(">QI")
+_LENGTH_STRUCT = struct.Struct(">Q")
+
+
+def _encode_hash(hash_string: str):
+    """
+    Encode a hash compactly as a 32 byte digest if it is a SHA256 hex digest and as
+    a length-prefixed UTF-8 string otherwise (e.g. the '0' of the first block).
+
+    :param hash_string: The hash which should be encoded
+    :return: The encoded hash as bytes
+    """
+
+    if len(hash_string) == 64:
+        try:
+            return bytes([HASH_DIGEST]) + bytes.fromhex(hash_string)
+        except ValueError:
+            pass
+    encoded_string = bytes(hash_string, 'utf-8')
+    return bytes([HASH_STRING]) + struct.pack(">H", len(encoded_string)) + encoded_string
+
+
+def _read_exactly(file, size: int):
+    """
+    Read exactly the given number of bytes from a file object.
+
+    :param file: A binary file object
+    :param size: The number of bytes to read
+    :return: The bytes read from the file
+    :raises ValueError: If the file ends prematurely
+    """
+
+    data = file.read(size)
+    if len(data) != size:
+        raise ValueError("The snapshot ended unexpectedly")
+    return data
+
+
+def _decode_hash(file):
+    """
+    Read a hash encoded by _encode_hash() from a file object.
+
+    :param file: A binary file object
+    :return: The decoded hash as a string
+    :raises ValueError: If the hash could not be decoded
+    """
+
+    encoding = _read_exactly(file, 1)[0]
+    if encoding == HASH_DIGEST:
+        return _read_exactly(file, 32).hex()
+    if encoding == HASH_STRING:
+        length = struct.unpack(">H", _read_exactly(file, 2))[0]
+        return _read_exactly(file, length).decode('utf-8')
+    raise ValueError("The snapshot contains an invalid hash encoding")
+
+
+def encode_block(block: Block):
+    """
+    Encode a single Block object as a record of the snapshot.
+
+    :param block: The Block object
+    :return: The encoded record as bytes
+    """
+
+    chunk = block.get_chunk()
+    return b"".join((RECORD_BLOCK,
+                     _encode_hash(block.hash),
+                     _RECORD_STRUCT.pack(block.index_all, len(chunk)),
+                     _encode_hash(block.hash_previous),
+                     chunk))
+
+
+def write_snapshot(blocks: [Block], files: dict, tip_hash: str):
+    """
+    Generate a snapshot of the given blocks in several parts, so that it can be
+    streamed to a file or as a response without being assembled in memory.
+
+    :param blocks: The list of all Block objects in the chain
+    :param files: The index of all files in the chain, mapping the hash of every file to
+                  the position of its first block and its number of blocks
+    :param tip_hash: The hash of the last block in the chain or '0' for an empty chain
+    :return: A generator yielding the snapshot as bytes
+    """
+
+    yield MAGIC_HEADER
+
+    # Collect several records before yielding them to reduce the overhead of the stream
+    for start in range(0, len(blocks), BATCH_SIZE):
+        yield b"".join(encode_block(block) for block in blocks[start:start + BATCH_SIZE])
+
+    manifest = bytes(json.dumps({"block_count": len(blocks),
+                                 "tip_hash": tip_hash,
+                                 "files": files}), 'utf-8')
+    yield RECORD_END + manifest + _LENGTH_STRUCT.pack(len(manifest)) + MAGIC_FOOTER
+
+
+def read_snapshot(file):
+    """
+    Read all the blocks and the manifest from a snapshot created by write_snapshot().
+
+    :param file: A binary file object containing the snapshot
+    :return: A tuple of the list of all Block objects and the manifest as a dictionary
+    :raises ValueError: If the file is not a valid snapshot
+    """
+
+    if file.read(len(MAGIC_HEADER)) != MAGIC_HEADER:
+        raise ValueError("The file is not a valid snapshot")
+
+    blocks = []
+    while True:
+        record_type = _read_exactly(file, 1)
+        if record_type == RECORD_END:
+            break
+        if record_type != RECORD_BLOCK:
+            raise ValueError("The snapshot contains an invalid record")
+        file_hash = _decode_hash(file)
+        index_all, chunk_size = _RECORD_STRUCT.unpack(_read_exactly(file, _RECORD_STRUCT.size))
+        hash_previous = _decode_hash(file)
+        blocks.append(Block(file_hash=file_hash,
+                            index_all=index_all,
+                            chunk=_read_exactly(file, chunk_size),
+                            hash_previous=hash_previous))
+
+    # The remaining data consists of the manifest, its length and the magic footer
+    trailer = file.read()
+    footer_size = _LENGTH_STRUCT.size + len(MAGIC_FOOTER)
+    if len(trailer) < footer_size or trailer[-len(MAGIC_FOOTER):] != MAGIC_FOOTER:
+        raise ValueError("The snapshot does not contain a valid manifest")
+    manifest_size = _LENGTH_STRUCT.unpack(trailer[-footer_size:-len(MAGIC_FOOTER)])[0]
+    if manifest_size != len(trailer) - footer_size:
+        raise ValueError("The snapshot does not contain a valid manifest")
+    manifest = json.loads(trailer[:manifest_size])
+    if not isinstance(manifest, dict):
+        raise ValueError("The snapshot does not contain a valid manifest")
+    if manifest.get("block_count") != len(blocks):
+        raise ValueError("The number of blocks does not match the manifest")
+
+    return blocks, manifest
+
+
+if __name__ == "__main__":
+    pass
@@ -4,11 +4,24 @@ This module provides tests for most important functions in the different modules
 @author: Manuel Hettich
 """
 
+import asyncio
+import io
+import json
 import pickle
 import os
+import socket
+import struct
+import threading
+import time
+import pytest
+import uvicorn
 from fastapi.testclient import TestClient
+from src import server
 from src.server import app
-from src.block import generate_blocks
+from src.block import Block, generate_blocks, generate_blocks_from_data
+from src.compression import compress
+from src.loadgen import parse_arguments, parse_mix, percentile, run_load_test
+from src.snapshot import MAGIC_FOOTER, MAGIC_HEADER, read_snapshot, write_snapshot
 
 client = TestClient(app)
 
@@ -183,3 +196,354 @@ def test_integrity_check():
 
     assert response.ok
     assert response.json() == {"integrity_check": True}
+
+
+def test_send_compressed_file(monkeypatch):
+    """
+    Check if the server can correctly receive a file compressed with zlib on the wire, store it
+    compressed in memory and report the achieved compression ratios.
+
+    :return: None
+    """
+
+    # Generate the blocks for the text file which is not present on the server
+    text_file = os.path.join(os.path.dirname(__file__), "../test_files/small.txt")
+    # Ask the server for the hash of the last block
+    response = client.get("/latest_block_hash")
+    last_block_hash = response.json()["last_block_hash"]
+    blocks = generate_blocks(text_file, last_block_hash)
+    # Compress the collected blocks with a codec supported by the server
+    response = client.get("/compression")
+    assert response.ok
+    assert "zlib" in response.json()["codecs"]
+    blocks_compressed = compress(pickle.dumps(blocks), "zlib")
+
+    # Send the compressed blocks to the test server which stores the chunks compressed
+    # without holding the chain lock during the compression
+    compress_chunk = Block.compress_chunk
+
+    def compress_chunk_unlocked(block, codec):
+        assert not server.chain_lock.locked()
+        compress_chunk(block, codec)
+
+    monkeypatch.setattr(Block, "compress_chunk", compress_chunk_unlocked)
+    monkeypatch.setattr(server, "storage_codec", "zlib")
+    response = client.post("/send",
+                           files={"file": blocks_compressed},
+                           data={"codec": "zlib"})
+    monkeypatch.undo()
+    assert response.ok
+    assert response.json()["success"]
+    assert response.json()["new_file"]
+
+    # The block hashes are still defined over the uncompressed chunks
+    response = client.get("/latest_block_hash")
+    assert response.json()["last_block_hash"] == blocks[-1].generate_hash()
+    response = client.get("/check",
+                          params={"file_hash": blocks[0].hash,
+                                  "index_all": blocks[0].index_all})
+    assert response.json()["check"]
+    response = client.get("/check_integrity")
+    assert response.json() == {"integrity_check": True}
+
+    # The server reports the achieved compression ratios
+    response = client.get("/compression")
+    assert response.json()["wire_ratio"] > 1
+    assert response.json()["storage_ratio"] > 1
+
+    # Payloads which cannot be decompressed are not counted
+    statistics = response.json()
+    response = client.post("/send", files={"file": b"not compressed"}, data={"codec": "zlib"})
+    assert response.json() == {"success": False}
+    assert client.get("/compression").json() == statistics
+
+
+def test_snapshot_export_import(monkeypatch):
+    """
+    Check if the chain of the server can be exported as a snapshot and imported into
+    a server with an empty chain, both with and without trusting the manifest.
+
+    :return: None
+    """
+
+    # Export the whole chain of the test server
+    response = client.get("/snapshot")
+    assert response.ok
+    snapshot_data = response.content
+    last_block_hash = client.get("/latest_block_hash").json()["last_block_hash"]
+    snapshot_blocks, manifest = read_snapshot(io.BytesIO(snapshot_data))
+    assert manifest["block_count"] == len(snapshot_blocks) == len(server.blocks)
+    assert manifest["tip_hash"] == last_block_hash
+    assert manifest["files"] == server.file_index
+
+    # A snapshot can only be imported into an empty chain
+    response = client.post("/snapshot", files={"file": snapshot_data})
+    assert response.json()["success"] is False
+
+    for trust_manifest in (False, True):
+        # Simulate a new server without any blocks
+        monkeypatch.setattr(server, "blocks", [])
+        monkeypatch.setattr(server, "file_index", {})
+        monkeypatch.setattr(server, "file_hashes", [])
+        response = client.post("/snapshot",
+                               files={"file": snapshot_data},
+                               params={"trust_manifest": trust_manifest})
+        assert response.ok
+        assert response.json() == {"success": True,
+                                   "block_count": manifest["block_count"],
+                                   "tip_hash": last_block_hash}
+        assert client.get("/latest_block_hash").json()["last_block_hash"] == last_block_hash
+        assert client.get("/check_integrity").json() == {"integrity_check": True}
+
+
+def test_snapshot_import_corrupted(monkeypatch):
+    """
+    Check if the server rejects a snapshot whose blocks do not match the manifest.
+
+    :return: None
+    """
+
+    snapshot_data = bytearray(client.get("/snapshot").content)
+    snapshot_blocks, manifest = read_snapshot(io.BytesIO(snapshot_data))
+    # Modify a byte of the last chunk in front of the manifest
+    snapshot_data[snapshot_data.rindex(b"\x00{") - 1] ^= 0xFF
+
+    monkeypatch.setattr(server, "blocks", [])
+    monkeypatch.setattr(server, "file_index", {})
+    monkeypatch.setattr(server, "file_hashes", [])
+    for trust_manifest in (False, True):
+        response = client.post("/snapshot",
+                               files={"file": bytes(snapshot_data)},
+                               params={"trust_manifest": trust_manifest})
+        assert response.ok
+        assert response.json()["success"] is False
+    assert len(server.blocks) == 0
+
+    # Truncated snapshots are rejected as well
+    response = client.post("/snapshot", files={"file": bytes(snapshot_data[:1000])})
+    assert response.json()["success"] is False
+
+    # The file index of a trusted manifest has to reference blocks of its files
+    file_hash = snapshot_blocks[0].hash
+    for files in ({file_hash: ["a", 16], "x": [0, 1]},
+                  {file_hash: [999999, 16]},
+                  {file_hash: [True, 16]},
+                  {"x": [0, 1]}):
+        tampered_snapshot = b"".join(write_snapshot(snapshot_blocks, files, manifest["tip_hash"]))
+        response = client.post("/snapshot",
+                               files={"file": tampered_snapshot},
+                               params={"trust_manifest": True})
+        assert response.ok
+        assert response.json() == {"success": False,
+                                   "error": "The file index of the manifest is invalid"}
+    assert len(server.blocks) == 0
+
+    # The manifest has to be a JSON object
+    empty_snapshot = MAGIC_HEADER + b"\x00[1]" + struct.pack(">Q", 3) + MAGIC_FOOTER
+    response = client.post("/snapshot", files={"file": empty_snapshot})
+    assert response.ok
+    assert response.json() == {"success": False,
+                               "error": "The snapshot does not contain a valid manifest"}
+
+
+def test_list_blocks():
+    """
+    Check if the metadata of the blocks can be read page by page and as a NDJSON stream.
+
+    :return: None
+    """
+
+    # Read the whole chain page by page
+    pages = []
+    cursor = 0
+    while cursor is not None:
+        response = client.get("/blocks", params={"cursor": cursor, "limit": 1000})
+        assert response.ok
+        pages.extend(response.json()["blocks"])
+        cursor = response.json()["next_cursor"]
+    assert [block["position"] for block in pages] == list(range(len(server.blocks)))
+    assert pages[0]["hash_previous"] == "0"
+    assert all(block["hash_previous"] == previous["block_hash"]
+               for previous, block in zip(pages, pages[1:]))
+    assert pages[-1]["block_hash"] \
+           == client.get("/latest_block_hash").json()["last_block_hash"]
+    assert "chunk" not in pages[0]
+
+    # The stream contains the same metadata as the pages
+    response = client.get("/blocks/stream", params={"cursor": 5000, "limit": 2000})
+    assert response.ok
+    streamed = [json.loads(line) for line in response.text.splitlines()]
+    assert streamed == pages[5000:7000]
+
+    # The size of a page is limited
+    response = client.get("/blocks", params={"limit": 100000})
+    assert response.status_code == 422
+
+
+def test_list_files():
+    """
+    Check if the files stored on the server can be listed page by page.
+
+    :return: None
+    """
+
+    first_file_hash = "45f293033312d42815155e871f37b56b4de9b925c07d4a5f6262320c1627db12"
+    response = client.get("/files", params={"limit": 1})
+    assert response.ok
+    assert response.json() \
+           == {"files": [{"file_hash": first_file_hash,
+                          "position": 0,
+                          "index_all": 5285}],
+               "next_cursor": 1}
+    response = client.get("/files", params={"cursor": 1})
+    assert [file["file_hash"] for file in response.json()["files"]] == server.file_hashes[1:]
+    assert response.json()["next_cursor"] is None
+
+
+def test_send_invalid_blocks(tmp_path):
+    """
+    Check if the server rejects uploaded blocks which are invalid and reports the errors
+    without appending any of the blocks to the chain.
+
+    :return: None
+    """
+
+    test_file = tmp_path / "new.txt"
+    test_file.write_bytes(b"New content for the validation of uploaded blocks. " * 40)
+    number_of_blocks = len(server.blocks)
+
+    # The chunk of a block does not match the file hash
+    blocks = generate_blocks(test_file, client.get("/latest_block_hash").json()["last_block_hash"])
+    blocks[-1].chunk = b"modified"
+    response = client.post("/send", files={"file": pickle.dumps(blocks)})
+    assert response.ok
+    assert response.json() \
+           == {"success": False,
+               "code": "invalid_blocks",
+               "errors": [{"position": None, "message": "The chunks do not match the file hash"}]}
+
+    # A block does not reference its previous block
+    blocks = generate_blocks(test_file, client.get("/latest_block_hash").json()["last_block_hash"])
+    blocks[2].hash_previous = blocks[0].generate_hash()
+    response = client.post("/send", files={"file": pickle.dumps(blocks)})
+    assert response.json()["success"] is False
+    assert [error["position"] for error in response.json()["errors"]] == [2, 3]
+    assert response.json()["errors"][0]["message"] \
+           == "The block does not reference the hash of the previous block"
+
+    # A block is missing
+    blocks = generate_blocks(test_file, client.get("/latest_block_hash").json()["last_block_hash"])
+    response = client.post("/send", files={"file": pickle.dumps(blocks[:-1])})
+    assert response.json()["success"] is False
+    assert response.json()["errors"][0] \
+           == {"position": None, "message": "The number of blocks (4) does not match index_all (5)"}
+
+    # The first block does not reference the last block in the chain
+    blocks = generate_blocks(test_file, '0')
+    response = client.post("/send", files={"file": pickle.dumps(blocks)})
+    assert response.json() \
+           == {"success": False,
+               "code": "stale_tip",
+               "errors": [{"position": 0,
+                           "message": "The block does not reference the hash of the last block "
+                                      "in the chain"}]}
+
+    # The attributes of a block have invalid types
+    for attribute, value, message in (("hash_previous", None, "The previous hash of the block is "
+                                                              "not a string"),
+                                      ("hash", 5, "The file hash of the block is not a string"),
+                                      ("index_all", "5", "The number of blocks of the block is "
+                                                         "not an integer")):
+        blocks = generate_blocks(test_file, '0')
+        setattr(blocks[1], attribute, value)
+        response = client.post("/send", files={"file": pickle.dumps(blocks)})
+        assert response.ok
+        assert response.json()["success"] is False
+        assert response.json()["errors"] == [{"position": 1, "message": message}]
+
+    # No blocks were appended and the chain is still intact
+    assert len(server.blocks) == number_of_blocks
+    assert client.get("/check_integrity").json() == {"integrity_check": True}
+
+
+def test_generate_blocks_from_data():
+    """
+    Check if the blocks generated from data in memory match the blocks generated from a file.
+
+    :return: None
+    """
+
+    for filename in ("small.txt", "empty.txt"):
+        test_file = os.path.join(os.path.dirname(__file__), "../test_files", filename)
+        with open(test_file, "rb") as file:
+            data = file.read()
+        assert [block.generate_hash() for block in generate_blocks_from_data(data, '0')] \
+               == [block.generate_hash() for block in generate_blocks(test_file, '0')]
+
+
+def test_loadgen_helpers():
+    """
+    Check the parsing of the workload mix and the calculation of the latency percentiles
+    of the load generator.
+
+    :return: None
+    """
+
+    assert parse_mix("send=5,check=4") == {"send": 5.0, "check": 4.0, "integrity": 0.0}
+    for invalid_mix in ("upload=1", "send=0", "send=1,check=-1"):
+        with pytest.raises(ValueError):
+            parse_mix(invalid_mix)
+
+    latencies = list(range(1, 101))
+    assert percentile(latencies, 0.5) == 50
+    assert percentile(latencies, 0.99) == 99
+    assert percentile(latencies, 1.0) == 100
+    assert percentile([], 0.5) == 0.0
+
+
+@pytest.fixture
+def running_server():
+    """
+    Run the test server in a background thread so that it can be reached via HTTP.
+
+    :return: The port of the running server
+    """
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    uvicorn_server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port,
+                                                   log_level="warning"))
+    thread = threading.Thread(target=uvicorn_server.run)
+    thread.start()
+    while not uvicorn_server.started:
+        time.sleep(0.01)
+    yield port
+    uvicorn_server.should_exit = True
+    thread.join()
+
+
+def test_loadgen_run(running_server):
+    """
+    Check if concurrent virtual clients of the load generator retry their forked uploads
+    and leave a consistent chain on the server.
+
+    :return: None
+    """
+
+    args = parse_arguments(["127.0.0.1", str(running_server),
+                            "--clients", "8",
+                            "--operations", "4",
+                            "--duration", "60",
+                            "--mix", "send=3,check=1",
+                            "--max-size", "5000",
+                            "--max-retries", "50",
+                            "--seed", "1"])
+    stats = asyncio.run(run_load_test(args))
+
+    assert stats.retries > 0
+    assert sum(stats.errors.values()) == 0
+    assert stats.consistency == {"integrity_check": True,
+                                 "missing_files": 0,
+                                 "duplicate_files": 0,
+                                 "consistent": True}